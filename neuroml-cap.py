@@ -28,6 +28,12 @@ def neuromlcap():
     tasks.add_argument(
         "--analyse", action="store_true", help="Create and execute analyses"
     )
+    tasks.add_argument(
+        "--resume",
+        action="store",
+        help="Resume analyses in an existing folder, and plot",
+        metavar="folder",
+    )
     tasks.add_argument(
         "--plot", action="store", help="Plot analysis results", metavar="folder"
     )
@@ -42,6 +48,10 @@ def neuromlcap():
     elif args.analyse:
         analysis.prepare(folder=None)
         analysis.analyse()
+    elif args.resume:
+        analysis.prepare(args.resume)
+        analysis.analyse()
+        analysis.plot()
     elif args.plot:
         analysis.prepare(args.plot)
         analysis.plot()
@@ -22,15 +22,13 @@ from matplotlib.pyplot import cm
 from pyneuroml.io import read_neuroml2_file, write_neuroml2_file
 from pyneuroml.lems.LEMSSimulation import LEMSSimulation
 from pyneuroml.utils.units import convert_to_units
-from pyneuroml.runners import (
-    run_multiple_lems_with,
-    execute_command_in_dir,
-    execute_multiple_in_dir,
-)
+from pyneuroml.runners import run_multiple_lems_with, execute_command_in_dir
 from pyneuroml.plot.PlotTimeSeries import plot_time_series_from_lems_file
 
 from ..plot.plot import plot_morphology_2d
 from ..config.config import read_config
+from ..executor.executor import execute_supervised, nrn_runner
+from ..recorder.recorder import Recorder, SimSpec, SimStatus
 from ..utils.utils import create_analysis_dir
 
 logger = logging.getLogger(__name__)
@@ -40,11 +38,6 @@ logger.setLevel(logging.DEBUG)
 class NeuroMLCAP(object):
     """Main class for NeuroMLCAP"""
 
-    recorded_segments_file = "segments_recorded.json"
-    fi_sims_file = "sims_fi.json"
-    poisson_input_sims_file = "sims_poisson_inputs.json"
-    poisson_input_segments_file = "segments_poisson_inputs.json"
-
     def __init__(self, config_file_name):
         """Initialise"""
         self.cfg_file_name = config_file_name
@@ -53,18 +46,19 @@ class NeuroMLCAP(object):
         self.cell = None
         self.analyses_dir = None
         self.model_files = None
-        # TODO: formalise recorders by creating recording classes with well
-        # defined attributes instead of using generic dicts: will make it
-        # easier to code/extend/access
-        self.recorder = {}
+        self.recorder = None  # type: Recorder
         self.unbranched_segment_groups = None
         self.recorded_segments = {}
 
-    def prepare(self, folder):
+    def prepare(self, folder, select_segments=True):
         """Prep for analyses
 
         :param folder: name of folder, if none given, create a new one
         :type folder: str
+        :param select_segments: for a new folder, whether to select the
+            segments to record from; if False, `get_segments_to_record` must
+            be called before creating simulations
+        :type select_segments: bool
 
         :returns: name of analysis folder
         :rtype: str
@@ -81,7 +75,9 @@ class NeuroMLCAP(object):
         if folder is None:
             self.analyses_dir = create_analysis_dir(self.cell_file, False)
             logger.info(f"Created new directory for analyses: {self.analyses_dir}")
-            # write to a file
+            # write the name of the latest analysis folder to a file in the
+            # current folder, outside the analysis folder and so its manifest,
+            # so that it can be found to plot or resume analyses
             with open("simulation.txt", "w") as f:
                 print(f"{self.analyses_dir}", file=f)
 
@@ -92,31 +88,26 @@ class NeuroMLCAP(object):
         else:
             self.analyses_dir = folder
 
-            # load sim data
-            with open(f"{folder}/{self.recorded_segments_file}", "r") as f:
-                self.recorded_segments = json.load(f)
-
-            if self.cfg["default"]["fi_curves"] is True:
-                with open(f"{folder}/{self.fi_sims_file}", "r") as f:
-                    recorder_fi = json.load(f)
-                    self.recorder["fi"] = recorder_fi
-            if self.cfg["default"]["poisson_inputs"] is True:
-                with open(f"{folder}/{self.poisson_input_sims_file}", "r") as f:
-                    recorder_poisson = json.load(f)
-                    self.recorder["poisson"] = recorder_poisson
-                with open(f"{folder}/{self.poisson_input_segments_file}", "r") as f:
-                    self.input_segment_marks = json.load(f)
-
         os.chdir(self.analyses_dir)
 
+        self.recorder = Recorder(Recorder.manifest_file)
+        if folder is not None:
+            # load sim data
+            if not os.path.isfile(Recorder.manifest_file):
+                self.__import_legacy_files()
+            self.recorder.load()
+            if "poisson_inputs" in self.recorder.segments:
+                self.input_segment_marks = self.recorder.segments["poisson_inputs"]
+
         self.nml_doc = read_neuroml2_file(
             self.cell_file
         )  # type: neuroml.NeuroMLDocument
         self.cell_obj = self.nml_doc.cells[0]  # type: neuroml.Cell
         if folder is None:
-            self.__get_segments_to_record(True)
+            if select_segments:
+                self.get_segments_to_record(True)
         else:
-            self.__get_segments_to_record(False)
+            self.get_segments_to_record(False)
 
         return self.analyses_dir
 
@@ -138,19 +129,21 @@ class NeuroMLCAP(object):
         for segs, seginfo in self.recorded_segments.items():
             line_colors.append(seginfo["marker_color"])
 
-        for sim_type, sims_specs in self.recorder.items():
-            for k, specs in sims_specs.items():
-                lems_file = specs["simfile"]
-                plot_time_series_from_lems_file(
-                    lems_file,
-                    show_plot_already=False,
-                    offset=True,
-                    labels=False,
-                    colors=line_colors,
-                    bottom_left_spines_only=True,
-                    save_figure_to=lems_file.replace(".xml", "_v.png"),
-                )
-                logger.info(f"Plotting time series for {lems_file}")
+        for spec in self.recorder.sims.values():
+            if spec.status != SimStatus.FINISHED:
+                logger.warning(f"Not plotting {spec.sim_id}: status is {spec.status}")
+                continue
+            lems_file = spec.simfile
+            plot_time_series_from_lems_file(
+                lems_file,
+                show_plot_already=False,
+                offset=True,
+                labels=False,
+                colors=line_colors,
+                bottom_left_spines_only=True,
+                save_figure_to=lems_file.replace(".xml", "_v.png"),
+            )
+            logger.info(f"Plotting time series for {lems_file}")
 
     def run_model_analyses(self):
         """Run analyses that can be done on the model"""
@@ -164,11 +157,14 @@ class NeuroMLCAP(object):
             plot_morphology_2d(self.cell_obj, self.recorded_segments, "morphology")
 
     def create_sim_analyses(self):
-        """Create analyses that require simulation of the model."""
+        """Create analyses that require simulation of the model.
+
+        Simulations that are already recorded in the manifest are not created
+        again, so that an interrupted analysis can be resumed.
+        """
         # fi-curves with step current at soma
         if self.cfg["default"]["fi_curves"] is True:
             logger.info("Generating fi curve simulations")
-            recorder_fi = {}
             if len(self.cfg["fi_curves"]["currents"]) == 0:
                 currents = numpy.linspace(
                     start=convert_to_units(self.cfg["fi_curves"]["currents_min"], "nA"),
@@ -178,69 +174,143 @@ class NeuroMLCAP(object):
 
                 self.sim_counter = 0
                 for cr in currents:
-                    simid, lems_file = self.generate_step_current_sim(
+                    if f"step_current_sim_{self.sim_counter}" in self.recorder.sims:
+                        self.sim_counter += 1
+                        continue
+                    simid, lems_file, data_file = self.generate_step_current_sim(
                         segment_id=0, current_nA=cr
                     )
-                    recorder_fi[simid] = {
-                        "simfile": lems_file,
-                        "segment": "0",
-                        "current": cr,
-                    }
+                    self.recorder.add_sim(
+                        SimSpec(
+                            sim_id=simid,
+                            sim_type="fi",
+                            simfile=lems_file,
+                            datafile=data_file,
+                            params={
+                                "segment": "0",
+                                "current": float(cr),
+                                "duration": convert_to_units(
+                                    self.cfg["fi_curves"]["sim_duration"], "ms"
+                                ),
+                                "dt": float(self.cfg["fi_curves"]["dt"]),
+                            },
+                        )
+                    )
                     self.sim_counter += 1
 
-            with open(self.fi_sims_file, "w") as f:
-                json.dump(recorder_fi, f)
-
-            self.recorder["fi"] = recorder_fi
-
         if self.cfg["default"]["poisson_inputs"] is True:
             logger.info("Generating poisson input simulations")
             self.sim_counter = 0
-            recorder_poisson = {}
             # same set of segments for each simulation, for each seed
-            self.poisson_input_segments = random.sample(
-                self.cell_obj.morphology.segments,
-                self.cfg["poisson_inputs"]["num_inputs"],
-            )
+            if "poisson_inputs" in self.recorder.segments:
+                # resuming: use the recorded input segments
+                self.input_segment_marks = self.recorder.segments["poisson_inputs"]
+                self.poisson_input_segments = [
+                    self.cell_obj.get_segment(int(s))
+                    for s in self.input_segment_marks.keys()
+                ]
+            else:
+                self.poisson_input_segments = random.sample(
+                    self.cell_obj.morphology.segments,
+                    self.cfg["poisson_inputs"]["num_inputs"],
+                )
 
-            colors = iter(
-                cm.rainbow(
-                    numpy.linspace(0, 1, self.cfg["poisson_inputs"]["num_inputs"])
+                colors = iter(
+                    cm.rainbow(
+                        numpy.linspace(0, 1, self.cfg["poisson_inputs"]["num_inputs"])
+                    )
                 )
-            )
 
-            self.input_segment_marks = {}
-            for sg in self.poisson_input_segments:
-                self.input_segment_marks[sg.id] = {
-                    "marker_size": self.cfg["default"]["segment_marker_size"],
-                    "marker_color": list(next(colors)),
-                }
-            plot_morphology_2d(self.cell_obj, self.input_segment_marks, "inputs")
+                self.input_segment_marks = {}
+                for sg in self.poisson_input_segments:
+                    self.input_segment_marks[sg.id] = {
+                        "marker_size": self.cfg["default"]["segment_marker_size"],
+                        "marker_color": list(next(colors)),
+                    }
+                plot_morphology_2d(self.cell_obj, self.input_segment_marks, "inputs")
+                self.recorder.add_segments("poisson_inputs", self.input_segment_marks)
 
             # number of iterations with different seeds for the poisson inputs
-            recorder_poisson = {}
             for i in range(0, self.cfg["poisson_inputs"]["num_iterations"]):
-                simid, lems_file = self.generate_poisson_input_sim()
-                recorder_poisson[simid] = {
-                    "simfile": lems_file,
-                }
+                if f"poisson_stim_sim_{self.sim_counter}" in self.recorder.sims:
+                    self.sim_counter += 1
+                    continue
+                # derive seeds from the configured seed so that they are the
+                # same when analyses are resumed
+                seed = self.cfg["default"]["seed"] + i
+                simid, lems_file, data_file = self.generate_poisson_input_sim(seed)
+                self.recorder.add_sim(
+                    SimSpec(
+                        sim_id=simid,
+                        sim_type="poisson",
+                        simfile=lems_file,
+                        datafile=data_file,
+                        params={
+                            "iteration": i,
+                            "seed": seed,
+                            "num_inputs": self.cfg["poisson_inputs"]["num_inputs"],
+                            "hz_inputs": self.cfg["poisson_inputs"]["hz_inputs"],
+                            "duration": convert_to_units(
+                                self.cfg["poisson_inputs"]["sim_duration"], "ms"
+                            ),
+                            "dt": float(self.cfg["poisson_inputs"]["dt"]),
+                        },
+                    )
+                )
+                self.sim_counter += 1
 
-            with open(self.poisson_input_segments_file, "w") as f:
-                json.dump(self.input_segment_marks, f)
+    def __import_legacy_files(self):
+        """Import simulation data from the JSON files used by analysis folders
+        created before the manifest was introduced into a new manifest.
 
-            with open(self.poisson_input_sims_file, "w") as f:
-                json.dump(recorder_poisson, f)
-            self.recorder["poisson"] = recorder_poisson
+        :raises FileNotFoundError: if neither a manifest nor the JSON files
+            are found in the analysis folder
+        """
+        if not os.path.isfile("segments_recorded.json"):
+            raise FileNotFoundError(
+                f"No {Recorder.manifest_file} found in {self.analyses_dir}: is it an analysis folder?"
+            )
+        logger.info(f"Importing simulation data into {Recorder.manifest_file}")
+
+        with open("segments_recorded.json", "r") as f:
+            self.recorder.add_segments("recorded", json.load(f))
+        if os.path.isfile("segments_poisson_inputs.json"):
+            with open("segments_poisson_inputs.json", "r") as f:
+                self.recorder.add_segments("poisson_inputs", json.load(f))
+
+        for sim_type, sims_file in [
+            ("fi", "sims_fi.json"),
+            ("poisson", "sims_poisson_inputs.json"),
+        ]:
+            if not os.path.isfile(sims_file):
+                continue
+            with open(sims_file, "r") as f:
+                sims = json.load(f)
+            for simid, specs in sims.items():
+                simfile = specs.pop("simfile")
+                spec = SimSpec(
+                    sim_id=simid,
+                    sim_type=sim_type,
+                    simfile=simfile,
+                    datafile=f"{simid}.v.dat",
+                    params=specs,
+                )
+                self.recorder.add_sim(spec)
+                if os.path.isfile(spec.datafile):
+                    self.recorder.set_status(
+                        simid,
+                        SimStatus.FINISHED,
+                        finished=os.path.getmtime(spec.datafile),
+                    )
 
-    def __get_segments_to_record(self, new: bool = False):
+    def get_segments_to_record(self, new: bool = False):
         """Get a segments to mark for recording from.
 
-        :param new: create new segments if True, else load from a file
+        :param new: create new segments if True, else load from the manifest
         :type new: bool
         """
         if not new:
-            with open(self.recorded_segments_file, "r") as f:
-                self.recorded_segments = json.load(f)
+            self.recorded_segments = self.recorder.segments["recorded"]
         else:
             self.unbranched_segment_groups = (
                 self.cell_obj.get_segment_groups_by_substring("", unbranched=True)
@@ -273,9 +343,8 @@ class NeuroMLCAP(object):
                     "marker_color": list(next(colors)),
                 }
 
-            # save recorded segments to a json file
-            with open(self.recorded_segments_file, "w") as f:
-                json.dump(self.recorded_segments, f)
+            # save recorded segments to the manifest
+            self.recorder.add_segments("recorded", self.recorded_segments)
 
         logger.debug(f"Segments being recorded from are: {self.recorded_segments}")
 
@@ -292,6 +361,8 @@ class NeuroMLCAP(object):
         :type current_nA: str
         :param segment_id: input segment id
         :type segment_id: str
+        :returns: tuple with simulation id, LEMS file name, output data file name
+        :rtype: tuple(str, str, str)
         """
         sim_id = f"step_current_sim_{self.sim_counter}"
         # sim
@@ -346,7 +417,8 @@ class NeuroMLCAP(object):
         ls.include_neuroml2_file(net_file_name)
         for f in self.cfg["default"]["extra_lems_definition_files"]:
             ls.include_lems_file(f)
-        ls.create_output_file("output_file", f"{sim_id}.v.dat")
+        data_file_name = f"{sim_id}.v.dat"
+        ls.create_output_file("output_file", data_file_name)
 
         for s in self.recorded_segments.keys():
             ls.add_column_to_output_file(
@@ -354,12 +426,18 @@ class NeuroMLCAP(object):
             )
 
         lems_file_name = ls.save_to_file()
-        return (sim_id, lems_file_name)
+        return (sim_id, lems_file_name, data_file_name)
 
-    def generate_poisson_input_sim(self):
+    def generate_poisson_input_sim(self, seed: int):
         """Create simulation with a number of poisson inputs being projected on to the cell.
 
         Each simulation uses the same inputs, but different seeds
+
+        :param seed: seed for the simulation
+        :type seed: int
+
+        :returns: tuple with simulation id, LEMS file name, output data file name
+        :rtype: tuple(str, str, str)
         """
         sim_id = f"poisson_stim_sim_{self.sim_counter}"
         # sim
@@ -367,7 +445,7 @@ class NeuroMLCAP(object):
             sim_id=sim_id,
             duration=convert_to_units(self.cfg["poisson_inputs"]["sim_duration"], "ms"),
             dt=self.cfg["poisson_inputs"]["dt"],
-            simulation_seed=random.randint(0, 99999),
+            simulation_seed=seed,
         )
         ls.include_neuroml2_file(self.cell_file, include_included=True)
         # nml model
@@ -438,7 +516,8 @@ class NeuroMLCAP(object):
         ls.include_neuroml2_file(net_file_name)
         for f in self.cfg["default"]["extra_lems_definition_files"]:
             ls.include_lems_file(f)
-        ls.create_output_file("output_file", f"{sim_id}.v.dat")
+        data_file_name = f"{sim_id}.v.dat"
+        ls.create_output_file("output_file", data_file_name)
 
         for s in self.recorded_segments.keys():
             ls.add_column_to_output_file(
@@ -446,44 +525,70 @@ class NeuroMLCAP(object):
             )
 
         lems_file_name = ls.save_to_file()
-        return (sim_id, lems_file_name)
+        return (sim_id, lems_file_name, data_file_name)
 
     def execute_simulations(self):
-        """Execute simulations in parallel"""
-        logger.info(f"recorder is: {self.recorder}")
+        """Execute simulations in parallel
+
+        Simulations that have already finished are skipped, so this can be
+        used to resume an interrupted analysis.
+        """
+        sims = [
+            spec
+            for spec in self.recorder.sims.values()
+            if spec.status != SimStatus.FINISHED
+        ]
+        logger.info(f"Simulations to run: {sims}")
+        self.generate_nrn_scripts(sims)
+        self.compile_mods()
+        self.run_simulations(sims)
+
+    def generate_nrn_scripts(self, sims):
+        """Generate NEURON scripts and mod files for simulations using
+        jNeuroML
+
+        :param sims: simulations to generate scripts for
+        :type sims: list(SimSpec)
+        """
         # generates all the NEURON simulations
         sims_spec = {}
-        for sim_type, sims_specs in self.recorder.items():
-            for k, specs in sims_specs.items():
-                sims_spec[specs["simfile"]] = {
-                    "engine": "jneuroml_neuron",
-                    "kwargs": {
-                        "nogui": True,
-                        "compile_mods": False,
-                        "skip_run": False,
-                        "only_generate_scripts": True,
-                    },
-                }
+        for spec in sims:
+            sims_spec[spec.simfile] = {
+                "engine": "jneuroml_neuron",
+                "kwargs": {
+                    "nogui": True,
+                    "compile_mods": False,
+                    "skip_run": False,
+                    "only_generate_scripts": True,
+                },
+            }
         logger.info(f"sims_spec is {sims_spec}")
         run_multiple_lems_with(self.cfg["default"]["num_parallel"], sims_spec=sims_spec)
+        for spec in sims:
+            self.recorder.set_status(spec.sim_id, SimStatus.GENERATED)
 
+    def compile_mods(self):
+        """Compile the generated mod files"""
         # compile all the mods
         # we're still in the analysis dir
         execute_command_in_dir("nrnivmodl", directory=".", verbose=False)
 
-        # run all the simulations
-        cmds_spec = []
-        results = None
-        for sim_type, sims_specs in self.recorder.items():
-            for k, specs in sims_specs.items():
-                cmds_spec.append(
-                    {
-                        "command": f"python3 {specs['simfile'].replace('.xml', '_nrn.py')}",
-                        "directory": ".",
-                        "verbose": False,
-                    }
-                )
-        logger.info(f"cmd_spec is {cmds_spec}")
-        results = execute_multiple_in_dir(
-            num_parallel=self.cfg["default"]["num_parallel"], cmds_spec=cmds_spec
+    def run_simulations(self, sims, runner=nrn_runner):
+        """Run generated simulation scripts in parallel under the watchdog
+
+        :param sims: simulations to run
+        :type sims: list(SimSpec)
+        :param runner: script to run simulations with
+        :type runner: str
+        """
+        execute_supervised(
+            self.recorder,
+            sims,
+            num_parallel=self.cfg["default"]["num_parallel"],
+            time_per_step=self.cfg["watchdog"]["time_per_step"],
+            min_time=self.cfg["watchdog"]["min_time"],
+            max_voltage=self.cfg["watchdog"]["max_voltage"],
+            chunk=self.cfg["watchdog"]["chunk_duration"],
+            poll_interval=self.cfg["watchdog"]["poll_interval"],
+            runner=runner,
         )
@@ -0,0 +1,657 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the stages of the analysis pipeline using synthetic cells
+
+Synthetic cells of increasing sizes are generated, and each stage of the
+pipeline is timed separately. Results are written to a JSON file that can be
+compared against a baseline from an earlier run.
+
+Usage:
+
+.. code:: bash
+
+    python -m neuromlcap.benchmark.benchmark --sizes 300 3000 30000 \\
+        --output bench.json --baseline old_bench.json
+
+File: neuromlcap/benchmark/benchmark.py
+
+Copyright 2024 Ankur Sinha
+Author: Ankur Sinha <sanjay DOT ankur AT gmail DOT com>
+"""
+
+
+import argparse
+import collections
+import contextlib
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import typing
+from datetime import datetime
+
+import neuroml
+import numpy
+from neuroml.neuro_lex_ids import neuro_lex_ids
+from pyneuroml.io import read_neuroml2_file, write_neuroml2_file
+
+from ..analysis.analysis import NeuroMLCAP
+from ..executor.executor import nrn_runner
+from ..recorder.recorder import Recorder
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# reversal potentials and conductance densities for channels of each ion.
+# Calcium channels are not supported because they require a concentration
+# model.
+ion_properties = {
+    "na": ("50.0 mV", "20.0 mS_per_cm2"),
+    "k": ("-85.0 mV", "10.0 mS_per_cm2"),
+    "hcn": ("-45.0 mV", "0.2 mS_per_cm2"),
+    "non_specific": ("-90.0 mV", "0.03 mS_per_cm2"),
+}
+
+config_template = """[default]
+seed = {seed}
+num_parallel = {num_parallel}
+cell_dir = "{cell_dir}"
+cell_file = "{cell_file}"
+extra_lems_definition_files = []
+plot_morphology = true
+num_segs_record = {num_segs_record}
+extra_segments_record = []
+segment_marker_size = 10
+fi_curves = true
+poisson_inputs = true
+
+[fi_curves]
+currents_min = "0.0 nA"
+currents_max = "0.5 nA"
+currents_steps = 2
+currents = []
+dt = "{dt}"
+temperature = "32degC"
+stim_start = "20ms"
+stim_duration = "50ms"
+sim_duration = "{sim_duration}ms"
+
+[poisson_inputs]
+num_inputs = {num_inputs}
+hz_inputs = 50
+num_iterations = 2
+dt = "{dt}"
+temperature = "32degC"
+sim_duration = "{sim_duration}ms"
+
+[watchdog]
+time_per_step = 0.005
+min_time = 60
+max_voltage = 1000
+chunk_duration = 10
+poll_interval = 0.1
+"""
+
+# stand in for the NeuroML to NEURON generated script
+stub_script_template = """duration = {duration}
+dt = {dt}
+seed = {seed}
+num_columns = {num_columns}
+datafile = "{datafile}"
+"""
+
+# stand in for the runner of NEURON scripts: writes resting potentials with
+# noise for each recorded segment, and progress, in chunks, in SI units
+stub_runner = """import runpy
+import sys
+
+import numpy
+
+sim = runpy.run_path(sys.argv[1])
+rng = numpy.random.default_rng(sim["seed"])
+steps = round(sim["duration"] / sim["dt"])
+chunk_steps = max(1, round(float(sys.argv[3]) / sim["dt"]))
+with open(sim["datafile"], "w") as data, open(sys.argv[2], "w") as progress:
+    for start in range(0, steps, chunk_steps):
+        t = numpy.arange(start, min(start + chunk_steps, steps)) * sim["dt"]
+        v = -65.0 + rng.standard_normal((len(t), sim["num_columns"]))
+        numpy.savetxt(data, numpy.column_stack((t, v)) / 1000.0, delimiter="\\t")
+        data.flush()
+        print(f"{t[-1] / 1000.0}\\t{v.min() / 1000.0}\\t{v.max() / 1000.0}", file=progress, flush=True)
+"""
+
+
+@contextlib.contextmanager
+def timed(timings: typing.Dict[str, float], stage: str):
+    """Context manager to time a stage
+
+    :param timings: dict to store stage timings in
+    :type timings: dict
+    :param stage: name of stage
+    :type stage: str
+    """
+    start = time.perf_counter()
+    yield
+    timings[stage] = time.perf_counter() - start
+    logger.info(f"Stage {stage} took {timings[stage]:.3f} s")
+
+
+def create_synthetic_cell(
+    cell_dir: str,
+    num_segments: int,
+    branching: int = 2,
+    branch_length: int = 10,
+    channels: typing.List[str] = ["pas", "NaTa_t", "SKv3_1"],
+    channel_dir: str = "L5PC",
+    seed: int = 1234,
+) -> str:
+    """Create a synthetic NeuroML cell
+
+    The cell has a soma and a dendritic tree: each unbranched section has
+    `branch_length` segments and ends in `branching` child sections, until the
+    required number of segments has been created.
+
+    :param cell_dir: folder to create cell model in
+    :type cell_dir: str
+    :param num_segments: total number of segments
+    :type num_segments: int
+    :param branching: number of child sections at the end of each section
+    :type branching: int
+    :param branch_length: number of segments in each section
+    :type branch_length: int
+    :param channels: ids of channels to include, from `channel_dir`
+    :type channels: list(str)
+    :param channel_dir: folder containing `<channel>.channel.nml` files
+    :type channel_dir: str
+    :param seed: seed for random orientation of sections
+    :type seed: int
+    :returns: name of cell file, in `cell_dir`
+    :rtype: str
+    :raises ValueError: if a channel is not supported
+    """
+    rng = random.Random(seed)
+    cell_id = f"synthetic_{num_segments}"
+    os.makedirs(cell_dir, exist_ok=True)
+
+    doc = neuroml.NeuroMLDocument(id=cell_id)
+    # also creates the default "all" and "soma_group" segment groups
+    cell = doc.add(neuroml.Cell, id=cell_id, validate=False)
+    segments = cell.morphology.segments
+    segment_groups = cell.morphology.segment_groups
+
+    soma = neuroml.Segment(
+        id=0,
+        name="soma",
+        proximal=neuroml.Point3DWithDiam(x=0, y=0, z=0, diameter=20),
+        distal=neuroml.Point3DWithDiam(x=0, y=20, z=0, diameter=20),
+    )
+    segments.append(soma)
+    # the soma is also an unbranched section
+    soma_section = neuroml.SegmentGroup(
+        id="soma_0", neuro_lex_id=neuro_lex_ids["section"]
+    )
+    soma_section.members.append(neuroml.Member(segments=0))
+    segment_groups.append(soma_section)
+    cell.get_segment_group("soma_group").includes.append(
+        neuroml.Include(segment_groups="soma_0")
+    )
+
+    # sections to create: parent segment, starting point, depth
+    queue = collections.deque([(soma, (0.0, 20.0, 0.0), 0)] * branching)
+    dend_groups = []  # type: typing.List[neuroml.SegmentGroup]
+    while len(queue) > 0 and len(segments) < num_segments:
+        parent, start, depth = queue.popleft()
+        # random direction in the upper hemisphere
+        theta = rng.uniform(0, math.pi / 2)
+        phi = rng.uniform(0, 2 * math.pi)
+        direction = (
+            math.sin(theta) * math.cos(phi),
+            math.cos(theta),
+            math.sin(theta) * math.sin(phi),
+        )
+        diameter = max(0.5, 4.0 / (depth + 1))
+
+        group = neuroml.SegmentGroup(
+            id=f"dend_{len(dend_groups)}", neuro_lex_id=neuro_lex_ids["section"]
+        )
+        point = start
+        for i in range(branch_length):
+            if len(segments) >= num_segments:
+                break
+            end = (
+                point[0] + 10.0 * direction[0],
+                point[1] + 10.0 * direction[1],
+                point[2] + 10.0 * direction[2],
+            )
+            seg = neuroml.Segment(
+                id=len(segments),
+                name=f"Seg{i}_{group.id}",
+                parent=neuroml.SegmentParent(segments=parent.id),
+                distal=neuroml.Point3DWithDiam(
+                    x=end[0], y=end[1], z=end[2], diameter=diameter
+                ),
+            )
+            # the first segment of a section needs an explicit proximal point
+            if i == 0:
+                seg.proximal = neuroml.Point3DWithDiam(
+                    x=point[0], y=point[1], z=point[2], diameter=diameter
+                )
+            segments.append(seg)
+            group.members.append(neuroml.Member(segments=seg.id))
+            parent = seg
+            point = end
+
+        segment_groups.append(group)
+        dend_groups.append(group)
+        queue.extend([(parent, point, depth + 1)] * branching)
+
+    dendrite_group = cell.add_segment_group(
+        group_id="dendrite_group", neuro_lex_id=neuro_lex_ids["dend"]
+    )
+    dendrite_group.includes = [
+        neuroml.Include(segment_groups=g.id) for g in dend_groups
+    ]
+    cell.get_segment_group("all").includes = [
+        neuroml.Include(segment_groups="soma_group"),
+        neuroml.Include(segment_groups="dendrite_group"),
+    ]
+    cell.reorder_segment_groups()
+
+    # biophysics
+    cell.set_init_memb_potential("-75.0 mV")
+    cell.set_resistivity("0.1 kohm_cm")
+    cell.set_specific_capacitance("1.0 uF_per_cm2")
+    cell.set_spike_thresh("0 mV")
+    for channel in channels:
+        channel_file = f"{channel}.channel.nml"
+        channel_doc = read_neuroml2_file(os.path.join(channel_dir, channel_file))
+        channel_obj = (channel_doc.ion_channel_hhs + channel_doc.ion_channel)[0]
+        # passive channels do not specify an ion
+        ion = channel_obj.species if channel_obj.species else "non_specific"
+        if ion not in ion_properties:
+            raise ValueError(f"Channel {channel} with ion {ion} is not supported")
+        erev, cond_density = ion_properties[ion]
+        shutil.copy(os.path.join(channel_dir, channel_file), cell_dir)
+        cell.add_channel_density(
+            doc,
+            cd_id=f"{channel}_all",
+            ion_channel=channel,
+            cond_density=cond_density,
+            erev=erev,
+            ion=ion,
+            ion_chan_def_file=channel_file,
+        )
+
+    cell_file = f"{cell_id}.cell.nml"
+    write_neuroml2_file(doc, os.path.join(cell_dir, cell_file), validate=False)
+    return cell_file
+
+
+def write_stub_scripts(sims, num_columns: int) -> str:
+    """Write stub simulation scripts in place of the NEURON scripts, and the
+    stub runner to run them with
+
+    :param sims: simulations to write scripts for
+    :type sims: list(SimSpec)
+    :param num_columns: number of recorded columns, excluding time
+    :type num_columns: int
+    :returns: name of stub runner script
+    :rtype: str
+    """
+    runner = os.path.abspath("stub_runner.py")
+    with open(runner, "w") as f:
+        f.write(stub_runner)
+
+    for ctr, spec in enumerate(sims):
+        with open(spec.nrn_script, "w") as f:
+            f.write(
+                stub_script_template.format(
+                    duration=spec.params["duration"],
+                    dt=spec.params["dt"],
+                    seed=ctr,
+                    num_columns=num_columns,
+                    datafile=spec.datafile,
+                )
+            )
+
+    return runner
+
+
+def benchmark_cell(
+    work_dir: str,
+    num_segments: int,
+    branching: int,
+    branch_length: int,
+    channels: typing.List[str],
+    channel_dir: str,
+    simulator: str = "stub",
+    num_parallel: int = 4,
+    sim_duration: float = 100.0,
+    dt: float = 0.025,
+) -> typing.Dict[str, float]:
+    """Run the pipeline on a synthetic cell, timing each stage
+
+    The NEURON scripts are generated using jNeuroML with both simulators. With
+    the "stub" simulator, mod files are not compiled, and the generated
+    scripts are replaced by stub scripts before execution.
+
+    :param work_dir: folder to run the benchmark in
+    :type work_dir: str
+    :param num_segments: number of segments in cell
+    :type num_segments: int
+    :param branching: number of child sections at the end of each section
+    :type branching: int
+    :param branch_length: number of segments in each section
+    :type branch_length: int
+    :param channels: ids of channels to include
+    :type channels: list(str)
+    :param channel_dir: folder containing channel files
+    :type channel_dir: str
+    :param simulator: "stub" to use stub scripts that only write data, or
+        "neuron" to generate and run NEURON scripts
+    :type simulator: str
+    :param num_parallel: number of simulations to run in parallel
+    :type num_parallel: int
+    :param sim_duration: duration of simulations (ms)
+    :type sim_duration: float
+    :param dt: simulation time step (ms)
+    :type dt: float
+    :returns: dict of stage names and times (s)
+    :rtype: dict
+    """
+    timings = {}  # type: typing.Dict[str, float]
+    work_dir = os.path.abspath(work_dir)
+    channel_dir = os.path.abspath(channel_dir)
+    cwd = os.getcwd()
+    os.makedirs(work_dir, exist_ok=True)
+    os.chdir(work_dir)
+    try:
+        with timed(timings, "generate"):
+            cell_dir = f"synthetic_{num_segments}"
+            cell_file = create_synthetic_cell(
+                cell_dir,
+                num_segments,
+                branching=branching,
+                branch_length=branch_length,
+                channels=channels,
+                channel_dir=channel_dir,
+            )
+            num_sections = math.ceil((num_segments - 1) / branch_length)
+            config_file = os.path.abspath(f"analysis.{cell_dir}.toml")
+            with open(config_file, "w") as f:
+                f.write(
+                    config_template.format(
+                        seed=1234,
+                        num_parallel=num_parallel,
+                        cell_dir=cell_dir,
+                        cell_file=cell_file,
+                        num_segs_record=min(20, num_sections),
+                        num_inputs=min(200, num_segments),
+                        sim_duration=sim_duration,
+                        dt=dt,
+                    )
+                )
+
+        analysis = NeuroMLCAP(config_file)
+        with timed(timings, "prepare"):
+            # prepare changes to the analysis folder, so its name is relative
+            # to the work folder
+            analyses_dir = os.path.join(
+                work_dir, analysis.prepare(folder=None, select_segments=False)
+            )
+
+        with timed(timings, "segment_selection"):
+            analysis.get_segments_to_record(True)
+
+        with timed(timings, "sim_generation"):
+            analysis.create_sim_analyses()
+
+        sims = list(analysis.recorder.sims.values())
+        with timed(timings, "script_conversion"):
+            analysis.generate_nrn_scripts(sims)
+
+        if simulator == "neuron":
+            with timed(timings, "mod_compilation"):
+                analysis.compile_mods()
+            runner = nrn_runner
+        else:
+            runner = write_stub_scripts(sims, len(analysis.recorded_segments))
+
+        with timed(timings, "execution"):
+            analysis.run_simulations(sims, runner=runner)
+
+        with timed(timings, "ingest"):
+            recorder = Recorder(Recorder.manifest_file)
+            recorder.load()
+            for spec in recorder.sims.values():
+                numpy.loadtxt(spec.datafile)
+
+        # reading the configuration and cell again, for plotting
+        os.chdir(work_dir)
+        reloaded = NeuroMLCAP(config_file)
+        with timed(timings, "reload"):
+            reloaded.prepare(analyses_dir)
+
+        with timed(timings, "plot"):
+            reloaded.plot()
+    finally:
+        os.chdir(cwd)
+
+    return timings
+
+
+def compare_to_baseline(
+    results: typing.Dict[str, typing.Any],
+    baseline: typing.Dict[str, typing.Any],
+    tolerance: float = 1.2,
+    min_time: float = 0.1,
+) -> int:
+    """Compare benchmark results to a baseline
+
+    Runs are matched on their cell parameters, and the minimum time of each
+    stage is compared to the baseline's minimum time. Stages that take less
+    than `min_time` in both are not compared, since their timings are
+    dominated by noise.
+
+    :param results: benchmark results
+    :type results: dict
+    :param baseline: baseline benchmark results
+    :type baseline: dict
+    :param tolerance: ratio to baseline time above which a stage is
+        considered to have regressed
+    :type tolerance: float
+    :param min_time: time (s) below which stages are not compared
+    :type min_time: float
+    :returns: number of regressed stages
+    :rtype: int
+    :raises ValueError: if the benchmark settings differ from the baseline's
+    """
+    if results["settings"] != baseline.get("settings", None):
+        raise ValueError(
+            f"Benchmark settings {results['settings']} differ from baseline settings {baseline.get('settings', None)}"
+        )
+
+    def key(run):
+        return (
+            run["num_segments"],
+            run["branching"],
+            run["branch_length"],
+            tuple(run["channels"]),
+        )
+
+    baseline_runs = {key(run): run for run in baseline["runs"]}
+    regressions = 0
+    for run in results["runs"]:
+        base = baseline_runs.get(key(run), None)
+        if base is None:
+            logger.warning(f"No baseline for run: {key(run)}")
+            continue
+        for stage, times in run["stages"].items():
+            if stage not in base["stages"]:
+                continue
+            t = times["min"]
+            base_t = base["stages"][stage]["min"]
+            if t < min_time and base_t < min_time:
+                continue
+            ratio = t / base_t if base_t > 0 else math.inf
+            msg = f"{run['num_segments']} segments, {stage}: {t:.3f} s ({ratio:.2f}x baseline)"
+            if ratio > tolerance:
+                regressions += 1
+                logger.warning(f"Regression: {msg}")
+            else:
+                logger.info(msg)
+
+    return regressions
+
+
+def main():
+    """Main runner method"""
+    parser = argparse.ArgumentParser(
+        prog="neuromlcap-benchmark",
+        description="Benchmark NeuroMLCAP pipeline stages using synthetic cells",
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=[300, 3000, 30000, 300000],
+        help="Numbers of segments of synthetic cells",
+    )
+    parser.add_argument(
+        "--branching", type=int, default=2, help="Child sections per section"
+    )
+    parser.add_argument(
+        "--branch-length", type=int, default=10, help="Segments per section"
+    )
+    parser.add_argument(
+        "--channels",
+        nargs="+",
+        default=["pas", "NaTa_t", "SKv3_1"],
+        help="Channels to include in cells",
+    )
+    parser.add_argument(
+        "--channel-dir",
+        default="L5PC",
+        help="Folder containing the <channel>.channel.nml files",
+    )
+    parser.add_argument(
+        "--simulator",
+        choices=["stub", "neuron"],
+        default="stub",
+        help="Simulator to use for execution",
+    )
+    parser.add_argument(
+        "--num-parallel", type=int, default=4, help="Parallel simulations"
+    )
+    parser.add_argument(
+        "--sim-duration", type=float, default=100.0, help="Simulation duration (ms)"
+    )
+    parser.add_argument(
+        "--dt", type=float, default=0.025, help="Simulation time step (ms)"
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=3, help="Number of times to run each cell"
+    )
+    parser.add_argument(
+        "--work-dir",
+        default=None,
+        help="Folder to run benchmarks in, a temporary folder if not given",
+    )
+    parser.add_argument("--output", default="benchmark.json", help="Results file")
+    parser.add_argument("--baseline", default=None, help="Baseline results file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.2,
+        help="Ratio to baseline above which a stage is a regression",
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.1,
+        help="Time (s) below which stages are not compared to the baseline",
+    )
+    args = parser.parse_args()
+
+    work_dir = args.work_dir
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix="neuromlcap-benchmark-")
+    work_dir = os.path.abspath(work_dir)
+    logger.info(f"Running benchmarks in {work_dir}")
+
+    results = {
+        "created": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "simulator": args.simulator,
+            "num_parallel": args.num_parallel,
+            "sim_duration": args.sim_duration,
+            "dt": args.dt,
+        },
+        "runs": [],
+    }  # type: typing.Dict[str, typing.Any]
+    for num_segments in args.sizes:
+        logger.info(f"Benchmarking cell with {num_segments} segments")
+        all_timings = collections.defaultdict(list)  # type: typing.DefaultDict
+        for i in range(args.repeats):
+            timings = benchmark_cell(
+                os.path.join(work_dir, str(num_segments), str(i)),
+                num_segments,
+                branching=args.branching,
+                branch_length=args.branch_length,
+                channels=args.channels,
+                channel_dir=args.channel_dir,
+                simulator=args.simulator,
+                num_parallel=args.num_parallel,
+                sim_duration=args.sim_duration,
+                dt=args.dt,
+            )
+            for stage, t in timings.items():
+                all_timings[stage].append(t)
+
+        results["runs"].append(
+            {
+                "num_segments": num_segments,
+                "branching": args.branching,
+                "branch_length": args.branch_length,
+                "channels": args.channels,
+                "stages": {
+                    stage: {
+                        "min": min(times),
+                        "median": statistics.median(times),
+                        "times": times,
+                    }
+                    for stage, times in all_timings.items()
+                },
+            }
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    logger.info(f"Benchmark results written to {args.output}")
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        try:
+            regressions = compare_to_baseline(
+                results, baseline, args.tolerance, args.min_time
+            )
+        except ValueError as e:
+            logger.error(f"Not comparing to baseline: {e}")
+            sys.exit(-1)
+        if regressions > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Supervised execution of simulations
+
+Runs the generated NEURON scripts in parallel, with a watchdog that terminates
+simulations that exceed their time budget or whose recorded voltages diverge.
+
+The generated scripts are run in chunks by `nrn_runner.py`, which writes the
+progress of the simulation to a progress file that the watchdog monitors.
+
+File: neuromlcap/executor/executor.py
+
+Copyright 2024 Ankur Sinha
+Author: Ankur Sinha <sanjay DOT ankur AT gmail DOT com>
+"""
+
+
+import logging
+import math
+import os
+import subprocess
+import time
+import typing
+
+from ..recorder.recorder import Recorder, SimSpec, SimStatus
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+nrn_runner = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nrn_runner.py")
+
+
+def estimate_time_budget(spec: SimSpec, time_per_step: float, min_time: float) -> float:
+    """Estimate the wall clock time budget of a simulation
+
+    :param spec: simulation specification, with "duration" and "dt" (both in
+        ms) in its parameters
+    :type spec: SimSpec
+    :param time_per_step: wall clock time allowed per integration step (s)
+    :type time_per_step: float
+    :param min_time: minimum time budget (s), also used if the duration or
+        time step of the simulation are not known
+    :type min_time: float
+    :returns: time budget in seconds
+    :rtype: float
+    """
+    if "duration" not in spec.params or "dt" not in spec.params:
+        logger.warning(
+            f"Duration or dt of {spec.sim_id} not recorded, using time budget of {min_time} s"
+        )
+        return min_time
+    steps = spec.params["duration"] / spec.params["dt"]
+    return max(min_time, steps * time_per_step)
+
+
+def progress_file(spec: SimSpec) -> str:
+    """Get the name of the progress file of a simulation
+
+    :param spec: simulation specification
+    :type spec: SimSpec
+    :returns: name of progress file
+    :rtype: str
+    """
+    return f"{spec.datafile}.progress"
+
+
+class DivergenceMonitor(object):
+    """Monitor a growing file for diverging values
+
+    Each line of the file has the time followed by values to check. Only the
+    newly written part of the file is read on each check, in chunks. Files are
+    written in SI units, so voltages are in V.
+    """
+
+    __slots__ = ("file_name", "max_voltage", "offset", "partial")
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, file_name: str, max_voltage: float):
+        """Initialise
+
+        :param file_name: name of file to monitor
+        :type file_name: str
+        :param max_voltage: maximum absolute voltage (V) beyond which the
+            simulation is considered to have diverged
+        :type max_voltage: float
+        """
+        self.file_name = file_name
+        self.max_voltage = max_voltage
+        self.offset = 0
+        self.partial = ""
+
+    def check(self, final: bool = False) -> typing.Optional[str]:
+        """Check newly written data for divergence
+
+        :param final: whether the file is complete, in which case a last line
+            without a trailing new line is also checked
+        :type final: bool
+        :returns: description of divergence if found, None otherwise
+        :rtype: str
+        """
+        if not os.path.isfile(self.file_name):
+            return None
+        with open(self.file_name, "r") as f:
+            f.seek(self.offset)
+            for data in iter(lambda: f.read(self.chunk_size), ""):
+                lines = (self.partial + data).split("\n")
+                # last line may not have been completely written yet
+                self.partial = lines.pop()
+                for line in lines:
+                    error = self.__check_line(line)
+                    if error is not None:
+                        return error
+            self.offset = f.tell()
+
+        if final and len(self.partial) > 0:
+            line = self.partial
+            self.partial = ""
+            return self.__check_line(line)
+        return None
+
+    def __check_line(self, line: str) -> typing.Optional[str]:
+        """Check a line for divergence
+
+        :param line: line to check
+        :type line: str
+        :returns: description of divergence if found, None otherwise
+        :rtype: str
+        """
+        # first column is time
+        cols = line.split()
+        for val in cols[1:]:
+            try:
+                v = float(val)
+            except ValueError:
+                return f"unreadable value: {val} at t = {cols[0]} s"
+            if math.isnan(v) or abs(v) > self.max_voltage:
+                return f"voltage diverged: {val} V at t = {cols[0]} s"
+        return None
+
+
+class _SupervisedSim(object):
+    """A running simulation and its watchdog state"""
+
+    __slots__ = ("spec", "process", "log", "started", "budget", "monitor")
+
+    def __init__(
+        self,
+        spec: SimSpec,
+        budget: float,
+        max_voltage: float,
+        chunk: float,
+        runner: str,
+    ):
+        """Start the simulation
+
+        :param spec: simulation specification
+        :type spec: SimSpec
+        :param budget: wall clock time budget (s)
+        :type budget: float
+        :param max_voltage: maximum absolute voltage (V)
+        :type max_voltage: float
+        :param chunk: duration of simulation chunks (ms)
+        :type chunk: float
+        :param runner: script to run simulation with
+        :type runner: str
+        """
+        self.spec = spec
+        self.budget = budget
+        self.monitor = DivergenceMonitor(progress_file(spec), max_voltage)
+        self.log = open(f"{spec.sim_id}.nrn.log", "w")
+        self.started = time.time()
+        self.process = subprocess.Popen(
+            ["python3", runner, spec.nrn_script, progress_file(spec), str(chunk)],
+            stdout=self.log,
+            stderr=subprocess.STDOUT,
+        )
+
+    def terminate(self, grace: float = 5.0) -> None:
+        """Terminate the simulation, killing it if it does not stop
+
+        :param grace: time to wait after terminating before killing (s)
+        :type grace: float
+        """
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=grace)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def execute_supervised(
+    recorder: Recorder,
+    sims: typing.List[SimSpec],
+    num_parallel: int,
+    time_per_step: float,
+    min_time: float,
+    max_voltage: float,
+    chunk: float,
+    poll_interval: float = 1.0,
+    runner: str = nrn_runner,
+) -> None:
+    """Execute simulations in parallel under a watchdog
+
+    A simulation is terminated and marked failed if it exceeds its time
+    budget, or if its output diverges. Its slot is then given to the next
+    simulation in the queue.
+
+    If the supervisor itself is interrupted, all running simulations are
+    terminated and marked failed.
+
+    :param recorder: recorder to update with simulation status
+    :type recorder: Recorder
+    :param sims: simulations to execute
+    :type sims: list(SimSpec)
+    :param num_parallel: number of simulations to run in parallel
+    :type num_parallel: int
+    :param time_per_step: wall clock time allowed per integration step (s)
+    :type time_per_step: float
+    :param min_time: minimum time budget for a simulation (s)
+    :type min_time: float
+    :param max_voltage: maximum absolute voltage (mV)
+    :type max_voltage: float
+    :param chunk: duration of simulation chunks after which progress is
+        written (ms)
+    :type chunk: float
+    :param poll_interval: interval between watchdog checks (s)
+    :type poll_interval: float
+    :param runner: script to run simulations with, called with the
+        simulation script, progress file, and chunk duration as arguments
+    :type runner: str
+    """
+    queue = list(sims)
+    queue.reverse()
+    running = []  # type: typing.List[_SupervisedSim]
+    # output files are in SI units
+    max_voltage_V = max_voltage / 1000.0
+
+    try:
+        while len(queue) > 0 or len(running) > 0:
+            while len(queue) > 0 and len(running) < num_parallel:
+                spec = queue.pop()
+                budget = estimate_time_budget(spec, time_per_step, min_time)
+                logger.info(f"Starting {spec.sim_id} with time budget of {budget} s")
+                sim = _SupervisedSim(spec, budget, max_voltage_V, chunk, runner)
+                running.append(sim)
+                recorder.set_status(spec.sim_id, SimStatus.RUNNING, started=sim.started)
+
+            time.sleep(poll_interval)
+
+            for sim in list(running):
+                returncode = sim.process.poll()
+                error = sim.monitor.check(final=returncode is not None)
+                if error is None and returncode is None:
+                    elapsed = time.time() - sim.started
+                    if elapsed > sim.budget:
+                        error = f"time budget of {sim.budget} s exceeded"
+
+                if error is not None:
+                    if returncode is None:
+                        logger.error(f"Terminating {sim.spec.sim_id}: {error}")
+                        sim.terminate()
+                    recorder.set_status(sim.spec.sim_id, SimStatus.FAILED, error=error)
+                elif returncode is None:
+                    continue
+                elif returncode == 0 and os.path.isfile(sim.spec.datafile):
+                    recorder.set_status(sim.spec.sim_id, SimStatus.FINISHED)
+                else:
+                    error = f"exited with return code {returncode}"
+                    logger.error(f"Simulation {sim.spec.sim_id} failed: {error}")
+                    recorder.set_status(sim.spec.sim_id, SimStatus.FAILED, error=error)
+
+                sim.log.close()
+                running.remove(sim)
+    finally:
+        for sim in running:
+            logger.error(f"Terminating {sim.spec.sim_id}: supervisor interrupted")
+            if sim.process.poll() is None:
+                sim.terminate()
+            sim.log.close()
+            recorder.set_status(
+                sim.spec.sim_id, SimStatus.FAILED, error="supervisor interrupted"
+            )
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Run a NEURON script generated from a LEMS simulation in chunks
+
+The scripts generated by jNeuroML only write their output files once the
+simulation has completed. This runner loads the generated script, advances the
+simulation in chunks using `h.continuerun`, and after each chunk appends a line
+with the time and the minimum and maximum of the newly recorded values to a
+progress file, so that the progress of the simulation can be monitored while
+it runs. Once the simulation has completed, the generated script saves its
+results as usual.
+
+This relies on the structure of the scripts generated by jNeuroML: a
+`NeuronSimulation` class that is instantiated with literal keyword arguments
+in the `__main__` block, sets up the model and its recording vectors when
+created, and provides a `save_results` method. It has been checked against
+scripts generated for the HL23PYR cell and for synthetic cells by pyNeuroML
+1.3.22 with jNeuroML 0.14.0 (org.neuroml.export 1.11.0), run with NEURON
+9.0.2: the saved results are identical to those of running the generated
+script directly.
+
+Usage:
+
+.. code:: bash
+
+    python3 nrn_runner.py <script>_nrn.py <progress file> <chunk duration (ms)>
+
+File: neuromlcap/executor/nrn_runner.py
+
+Copyright 2024 Ankur Sinha
+Author: Ankur Sinha <sanjay DOT ankur AT gmail DOT com>
+"""
+
+
+import ast
+import importlib.util
+import sys
+import typing
+
+import numpy
+
+
+def get_simulation_kwargs(script: str) -> typing.Dict[str, typing.Any]:
+    """Get the arguments the generated script creates its simulation with
+
+    :param script: name of generated NEURON script
+    :type script: str
+    :returns: keyword arguments to `NeuronSimulation`
+    :rtype: dict
+    :raises ValueError: if the simulation is not created in the script
+    """
+    with open(script, "r") as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id == "NeuronSimulation"
+        ):
+            # skip any **kwargs expansions
+            return {
+                kw.arg: ast.literal_eval(kw.value)
+                for kw in node.keywords
+                if kw.arg is not None
+            }
+    raise ValueError(f"NeuronSimulation is not created in {script}")
+
+
+def is_time_vector(vector, t: float) -> bool:
+    """Check if a vector records time
+
+    :param vector: NEURON vector
+    :type vector: neuron.hoc.HocObject
+    :param t: current simulation time
+    :type t: float
+    :returns: True if the vector records time
+    :rtype: bool
+    """
+    values = vector.as_numpy()
+    return bool(
+        values[0] == 0.0 and values[-1] == t and numpy.all(numpy.diff(values) > 0)
+    )
+
+
+def run_in_chunks(script: str, progress_file: str, chunk: float) -> None:
+    """Run the simulation in a generated script in chunks
+
+    :param script: name of generated NEURON script
+    :type script: str
+    :param progress_file: name of file to append progress to
+    :type progress_file: str
+    :param chunk: duration of each chunk (ms)
+    :type chunk: float
+    :raises ValueError: if the script cannot be loaded, or does not have the
+        expected structure
+    """
+    kwargs = get_simulation_kwargs(script)
+    # the simulation is only run when the script is the main module
+    spec = importlib.util.spec_from_file_location("nrn_simulation", script)
+    if spec is None or spec.loader is None:
+        raise ValueError(f"Could not load {script}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if not hasattr(module, "h") or not hasattr(
+        getattr(module, "NeuronSimulation", None), "save_results"
+    ):
+        raise ValueError(
+            f"{script} does not have the structure of a script generated by jNeuroML"
+        )
+    h = module.h
+
+    ns = module.NeuronSimulation(**kwargs)
+    h.stdinit()
+
+    vectors = None
+    offset = 0
+    with open(progress_file, "w") as f:
+        # continuerun stops within half a time step of the stop time
+        while h.t < h.tstop - h.dt / 2:
+            h.continuerun(min(h.t + chunk, h.tstop))
+
+            if vectors is None:
+                # vectors recording at every time step, except the one
+                # recording time
+                all_vectors = list(h.List("Vector"))
+                size = max([v.size() for v in all_vectors], default=0)
+                vectors = [
+                    v
+                    for v in all_vectors
+                    if v.size() == size and not is_time_vector(v, h.t)
+                ]
+            if len(vectors) == 0:
+                continue
+
+            size = int(vectors[0].size())
+            new = numpy.concatenate([v.as_numpy()[offset:size] for v in vectors])
+            offset = size
+            if len(new) == 0:
+                continue
+            # in SI units, like the output files
+            print(
+                f"{h.t / 1000.0}\t{numpy.min(new) / 1000.0}\t{numpy.max(new) / 1000.0}",
+                file=f,
+                flush=True,
+            )
+
+    ns.save_results()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print("Usage: nrn_runner.py <script>_nrn.py <progress file> <chunk duration>")
+        sys.exit(-1)
+
+    run_in_chunks(sys.argv[1], sys.argv[2], float(sys.argv[3]))
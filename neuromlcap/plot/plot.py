@@ -11,12 +11,13 @@ Author: Ankur Sinha <sanjay DOT ankur AT gmail DOT com>
 
 import sys
 import typing
-import json
 import logging
 from pyneuroml.io import read_neuroml2_file
 from pyneuroml.plot.PlotMorphology import plot_2D_cell_morphology
 from pyneuroml.plot.PlotTimeSeries import plot_time_series_from_lems_file
 
+from ..recorder.recorder import Recorder
+
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -57,45 +58,39 @@ if __name__ == "__main__":
 
     print(f"Working on file {sys.argv[1]}")
     cell_obj = read_neuroml2_file(sys.argv[1]).cells[0]
-    recorded_segments = None
-    input_segments = None
-    fi_sims = None
-    poisson_sims = None
+    recorder = Recorder(Recorder.manifest_file)
+    recorder.load()
 
     # plot morphology with segments being recorded from marked
-    with open("segments_recorded.json", "r") as f:
-        recorded_segments = json.load(f)
+    recorded_segments = recorder.segments["recorded"]
     colors = [val["marker_color"] for val in recorded_segments.values()]
 
     # plot morphology with segments being input to marked
-    with open("segments_poisson_inputs.json", "r") as f:
-        input_segments = json.load(f)
+    input_segments = recorder.segments["poisson_inputs"]
 
     # get fi current sims
-    with open("sims_fi.json", "r") as f:
-        fi_sims = json.load(f)
+    fi_sims = recorder.sims_of_type("fi")
 
     # get poisson sims
-    with open("sims_poisson_inputs.json", "r") as f:
-        poisson_sims = json.load(f)
+    poisson_sims = recorder.sims_of_type("poisson")
 
     plot_morpholgy_2d(
         cell_obj, recorded_segments, "morphology", show_plot=True, plane=["xy"]
     )
 
-    for k, v in fi_sims.items():
+    for v in fi_sims:
         plot_time_series_from_lems_file(
-            v["simfile"],
+            v.simfile,
             show_plot_already=True,
             labels=False,
             colors=colors,
-            title=f"{v['current']} nA at soma",
+            title=f"{v.params['current']} nA at soma",
         )
 
     plot_morpholgy_2d(cell_obj, input_segments, "inputs", show_plot=True, plane=["xy"])
-    for k, v in poisson_sims.items():
+    for v in poisson_sims:
         plot_time_series_from_lems_file(
-            v["simfile"],
+            v.simfile,
             show_plot_already=True,
             labels=False,
             colors=colors,
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Recording of simulations and their state in an analysis folder
+
+All state for an analysis folder is kept in a single manifest file. The
+manifest is an append-only JSON lines log: each line either adds a new
+simulation, updates some fields of an existing simulation, or records a set of
+segment marks. Loading the manifest replays the log, so updates from workers
+only ever append a line instead of rewriting the complete file.
+
+File: neuromlcap/recorder/recorder.py
+
+Copyright 2024 Ankur Sinha
+Author: Ankur Sinha <sanjay DOT ankur AT gmail DOT com>
+"""
+
+
+import hashlib
+import json
+import logging
+import os
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class SimStatus(object):
+    """Possible states of a simulation"""
+
+    CREATED = "created"
+    GENERATED = "generated"
+    RUNNING = "running"
+    FINISHED = "finished"
+    FAILED = "failed"
+
+
+class SimSpec(object):
+    """Specification and run state of a single simulation"""
+
+    __slots__ = (
+        "sim_id",
+        "sim_type",
+        "simfile",
+        "datafile",
+        "params",
+        "status",
+        "created",
+        "started",
+        "finished",
+        "checksum",
+        "error",
+    )
+
+    def __init__(
+        self,
+        sim_id: str,
+        sim_type: str,
+        simfile: str,
+        datafile: str,
+        params: typing.Optional[typing.Dict[str, typing.Any]] = None,
+        status: str = SimStatus.CREATED,
+        created: typing.Optional[float] = None,
+        started: typing.Optional[float] = None,
+        finished: typing.Optional[float] = None,
+        checksum: typing.Optional[str] = None,
+        error: typing.Optional[str] = None,
+    ):
+        """Initialise
+
+        :param sim_id: id of simulation
+        :type sim_id: str
+        :param sim_type: type of simulation (analysis it belongs to)
+        :type sim_type: str
+        :param simfile: LEMS simulation file
+        :type simfile: str
+        :param datafile: output data file
+        :type datafile: str
+        :param params: parameters of the simulation
+        :type params: dict
+        :param status: status of simulation, see `SimStatus`
+        :type status: str
+        :param created: creation time stamp
+        :type created: float
+        :param started: time stamp of start of execution
+        :type started: float
+        :param finished: time stamp of end of execution
+        :type finished: float
+        :param checksum: sha256 checksum of the output data file
+        :type checksum: str
+        :param error: reason for failure of simulation
+        :type error: str
+        """
+        self.sim_id = sim_id
+        self.sim_type = sim_type
+        self.simfile = simfile
+        self.datafile = datafile
+        self.params = params if params is not None else {}
+        self.status = status
+        self.created = created if created is not None else time.time()
+        self.started = started
+        self.finished = finished
+        self.checksum = checksum
+        self.error = error
+
+    @property
+    def nrn_script(self) -> str:
+        """Name of the NEURON script generated from the LEMS file"""
+        return self.simfile.replace(".xml", "_nrn.py")
+
+    def to_dict(self) -> typing.Dict[str, typing.Any]:
+        """Get a dict representation of the simulation specification
+
+        :returns: dict with all attributes
+        :rtype: dict
+        """
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __repr__(self):
+        return f"SimSpec({self.sim_id}, {self.sim_type}, {self.status})"
+
+
+class Recorder(object):
+    """Recorder for all simulations in an analysis folder, backed by the
+    manifest file"""
+
+    manifest_file = "manifest.jsonl"
+
+    def __init__(self, manifest_path: str):
+        """Initialise
+
+        :param manifest_path: path of manifest file
+        :type manifest_path: str
+        """
+        self.manifest_path = os.path.abspath(manifest_path)
+        self.sims = {}  # type: typing.Dict[str, SimSpec]
+        self.segments = {}  # type: typing.Dict[str, typing.Dict]
+        # (parameter, value) -> sim ids
+        self.__index = {}  # type: typing.Dict[typing.Tuple, typing.List[str]]
+
+    def load(self) -> None:
+        """Load the manifest by replaying its records."""
+        self.sims = {}
+        self.segments = {}
+        self.__index = {}
+        with open(self.manifest_path, "r") as f:
+            for line in f:
+                # ignore partially written trailing lines
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping malformed manifest line: {line}")
+                    continue
+                self.__apply(record)
+        logger.debug(f"Loaded {len(self.sims)} simulations from {self.manifest_path}")
+
+    def add_segments(self, name: str, marks: typing.Dict) -> None:
+        """Record a set of marked segments
+
+        :param name: name of set of segments
+        :type name: str
+        :param marks: segment marks (highlight specification for plots)
+        :type marks: dict
+        """
+        self.__append({"kind": "segments", "name": name, "marks": marks})
+
+    def add_sim(self, spec: SimSpec) -> None:
+        """Record a new simulation
+
+        :param spec: simulation specification
+        :type spec: SimSpec
+        """
+        if spec.sim_id in self.sims:
+            raise ValueError(f"Simulation {spec.sim_id} already recorded")
+        record = spec.to_dict()
+        record["kind"] = "sim"
+        self.__append(record)
+
+    def update(self, sim_id: str, **fields: typing.Any) -> None:
+        """Update fields of a recorded simulation
+
+        :param sim_id: id of simulation to update
+        :type sim_id: str
+        :param fields: fields of `SimSpec` to update, with new values
+        """
+        if sim_id not in self.sims:
+            raise KeyError(f"Simulation {sim_id} not recorded")
+        for k in fields.keys():
+            if k not in SimSpec.__slots__ or k in ["sim_id", "params"]:
+                raise AttributeError(f"Cannot update field {k}")
+        record = dict(fields)
+        record["kind"] = "update"
+        record["sim_id"] = sim_id
+        self.__append(record)
+
+    def set_status(self, sim_id: str, status: str, **fields: typing.Any) -> None:
+        """Update the status of a simulation, recording timings and checksums
+
+        :param sim_id: id of simulation
+        :type sim_id: str
+        :param status: new status, see `SimStatus`
+        :type status: str
+        :param fields: other fields to update
+        """
+        if status == SimStatus.RUNNING:
+            if "started" not in fields:
+                fields["started"] = time.time()
+            # clear errors of previous runs
+            if "error" not in fields:
+                fields["error"] = None
+        elif status in [SimStatus.FINISHED, SimStatus.FAILED]:
+            if "finished" not in fields:
+                fields["finished"] = time.time()
+            if status == SimStatus.FINISHED and "checksum" not in fields:
+                fields["checksum"] = file_checksum(self.sims[sim_id].datafile)
+        self.update(sim_id, status=status, **fields)
+
+    def sims_of_type(self, sim_type: str) -> typing.List[SimSpec]:
+        """Get all simulations of a type
+
+        :param sim_type: type of simulation
+        :type sim_type: str
+        :returns: list of simulations
+        :rtype: list(SimSpec)
+        """
+        return [s for s in self.sims.values() if s.sim_type == sim_type]
+
+    def find(
+        self, sim_type: typing.Optional[str] = None, **params: typing.Any
+    ) -> typing.List[SimSpec]:
+        """Find simulations by their parameters
+
+        :param sim_type: type of simulation, if None, all types are searched
+        :type sim_type: str
+        :param params: parameters and values to match
+        :returns: list of matching simulations
+        :rtype: list(SimSpec)
+        """
+        if len(params) == 0:
+            if sim_type is None:
+                return list(self.sims.values())
+            return self.sims_of_type(sim_type)
+
+        matched = None  # type: typing.Optional[typing.Set[str]]
+        for param, value in params.items():
+            ids = set(self.__index.get((param, value), []))
+            matched = ids if matched is None else matched & ids
+        assert matched is not None
+
+        return [
+            self.sims[i]
+            for i in sorted(matched)
+            if sim_type is None or self.sims[i].sim_type == sim_type
+        ]
+
+    def __append(self, record: typing.Dict[str, typing.Any]) -> None:
+        """Append a record to the manifest and apply it.
+
+        The record is written with a single `write` call to a file opened in
+        append mode so that records from concurrent writers do not interleave.
+
+        :param record: record to append
+        :type record: dict
+        """
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        fd = os.open(self.manifest_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+        self.__apply(record)
+
+    def __apply(self, record: typing.Dict[str, typing.Any]) -> None:
+        """Apply a manifest record to the in memory state
+
+        :param record: record to apply
+        :type record: dict
+        """
+        record = dict(record)
+        kind = record.pop("kind")
+        if kind == "segments":
+            self.segments[record["name"]] = record["marks"]
+        elif kind == "sim":
+            spec = SimSpec(**record)
+            self.sims[spec.sim_id] = spec
+            for param, value in spec.params.items():
+                self.__index.setdefault((param, value), []).append(spec.sim_id)
+        elif kind == "update":
+            spec = self.sims[record.pop("sim_id")]
+            for k, v in record.items():
+                setattr(spec, k, v)
+        else:
+            logger.warning(f"Unknown manifest record kind: {kind}")
+
+
+def file_checksum(file_name: str) -> typing.Optional[str]:
+    """Get the sha256 checksum of a file
+
+    :param file_name: name of file
+    :type file_name: str
+    :returns: hex digest of checksum, None if file does not exist
+    :rtype: str
+    """
+    if not os.path.isfile(file_name):
+        return None
+    sha = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()